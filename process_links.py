@@ -1,106 +1,537 @@
 # -*- coding: utf-8 -*-
 import os
+import asyncio
 import base64
-import requests # Kept for potential future use or simple tasks
+import binascii
+import hashlib
+import json
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
-import pytz
+from zoneinfo import ZoneInfo
 from pathlib import Path
 import re
-import time
+import tempfile
+import queue
 import random
-
-# --- STEALTH MODE IMPORTS ---
-# The key to bypassing advanced bot detection like Cloudflare
-import undetected_chromedriver as uc
-from selenium.webdriver.common.by import By
+import threading
+from collections import Counter, defaultdict
+from collections.abc import Iterable
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
 LINKS_FILE = "links.txt"
 NORMAL_DIR = "normal"
 BASE64_DIR = "base64"
 README_FILE = "README.md"
+# Per-source HTTP validators and per-output digests from the previous run.
+STATE_FILE = "state.json"
+# Bodies of sources that sent HTTP validators, kept between runs by the workflow's cache
+# step so an unchanged source needed by an updated output is not downloaded again.
+CACHE_DIR = ".cache"
+# Temporary files are created 0600; written files get the mode a plain open() would give them.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+FILE_MODE = 0o666 & ~_UMASK
+# README timestamps are shown in Tehran time.
+README_TZ = ZoneInfo('Asia/Tehran')
 GITHUB_REPO = os.getenv("GITHUB_REPOSITORY")
 if not GITHUB_REPO:
     raise ValueError("GITHUB_REPOSITORY environment variable not set. This script should be run in a GitHub Action.")
 
+# Upper bound on sources fetched at the same time over plain HTTP.
+MAX_CONCURRENT_FETCHES = 16
+# Of those, at most this many go to any one host, to stay polite to raw.githubusercontent.com & co.
+MAX_FETCHES_PER_HOST = 8
+# Only challenge URLs reach a browser; Chrome is CPU/RAM heavy, so far fewer run at once.
+MAX_BROWSERS = 2
+# Output files are independent, so they are combined and written in parallel.
+MAX_OUTPUT_WORKERS = 16
+
 # --- Realistic User-Agents (still good practice) ---
-USER_AGENTS = [
+USER_AGENTS = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/125.0.0.0 Safari/537.36",
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Firefox/126.0",
-]
+)
+
+# --- Plain HTTP (tried first for every URL) ---
+# One pooled session so that sources on the same host reuse their TCP/TLS connection.
+HTTP_TIMEOUT = 15
+SESSION = requests.Session()
+SESSION.headers['User-Agent'] = random.choice(USER_AGENTS)
+# 503 is not retried here: Cloudflare serves its challenge with it, and that goes
+# straight to the browser fallback (see BROWSER_FALLBACK_STATUSES).
+_http_adapter = HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 504], raise_on_status=False),
+)
+SESSION.mount("https://", _http_adapter)
+SESSION.mount("http://", _http_adapter)
+
+class NotModified:
+    """Type of NOT_MODIFIED, so fetch results can be annotated precisely."""
+
+# Fetch result for a source whose server answered 304 to our conditional request.
+NOT_MODIFIED = NotModified()
+
+# Responses that mean a bot check is in the way; only these go to the browser.
+BROWSER_FALLBACK_STATUSES = (403, 503)
+# Static file hosts with no bot checks: an error from them is real, and a browser won't help.
+RAW_HOSTS = frozenset({"raw.githubusercontent.com", "gist.githubusercontent.com"})
+# Seconds to wait for a Cloudflare JS challenge to clear before giving up on a URL.
+CHALLENGE_TIMEOUT = 30
+CHALLENGE_MARKERS = ("Verifying you are human", "needs to review the security", "Just a moment...")
+_CHALLENGE_MARKERS_BYTES = tuple(marker.encode('utf-8') for marker in CHALLENGE_MARKERS)
+# Response bodies are read in chunks of this size instead of via response.text.
+HTTP_CHUNK_SIZE = 1 << 16
+# Output files are hashed and written in chunks of about this size, so the joined
+# file and its Base64 copy are never held in memory whole.
+OUTPUT_CHUNK_SIZE = 1 << 16
+
+# Browsers are reused across URLs; the cf_clearance cookie is kept so later
+# URLs on the same host skip the challenge. At most MAX_BROWSERS exist or are
+# checked out at once.
+_idle_drivers = queue.SimpleQueue()
+_browser_slots = threading.BoundedSemaphore(MAX_BROWSERS)
+# A long-lived Chrome slowly accumulates memory, so each one is replaced after this many URLs.
+BROWSER_RECYCLE_AFTER = 50
+_driver_uses = {}
+_all_drivers = []
+# undetected_chromedriver patches its driver binary on start-up, so launches are serialized.
+_DRIVER_START_LOCK = threading.Lock()
+
+# Base64 bodies only use this alphabet, so sniffing a prefix rules out most plain text early.
+B64_SNIFF_SIZE = 4096
+_B64_RE = re.compile(rb'^[A-Za-z0-9+/=\s]+\Z')
+# Everything \s admits above; deleted in one C-level bytes.translate() pass before decoding.
+_B64_WHITESPACE = b' \t\r\n\v\f'
+# Decoded subscriptions hold proxy URIs (vmess://, vless://, ss://, trojan://, ...).
+_PROXY_URI_RE = re.compile(rb'[A-Za-z][A-Za-z0-9+.-]*://')
+
+# github.com/<owner>/<repo>/blob/<ref>/<path> -> raw.githubusercontent.com/<owner>/<repo>/<ref>/<path>
+_GITHUB_BLOB_RE = re.compile(r'^https?://(?:www\.)?github\.com/([^/]+/[^/]+)/blob/(.*)\Z', re.DOTALL)
 
 # --- Helper Functions ---
 
 def convert_github_url_to_raw(url: str) -> str:
-    if "github.com" in url and "/blob/" in url:
-        return url.replace("github.com", "raw.githubusercontent.com").replace("/blob/", "/")
-    return url
-
-def is_base64(s: str) -> bool:
-    if not re.match(r'^[A-Za-z0-9+/=\s]+$', s.strip()):
-        return False
-    s_cleaned = "".join(s.split())
+    return _GITHUB_BLOB_RE.sub(r'https://raw.githubusercontent.com/\1/\2', url, count=1)
+
+def decode_base64(data: bytes) -> bytes | None:
+    """
+    Returns the decoded bytes when data is a (possibly line-wrapped) Base64 body,
+    otherwise None. Decoding doubles as the check, so callers never decode twice.
+    """
+    cleaned = data.translate(None, _B64_WHITESPACE)
+    if not cleaned:
+        return None
     try:
-        s_padded = s_cleaned + '=' * (-len(s_cleaned) % 4)
-        decoded_bytes = base64.b64decode(s_padded, validate=True)
-        return base64.b64encode(decoded_bytes).decode('utf-8') == s_padded
-    except (ValueError, TypeError):
-        return False
+        return base64.b64decode(cleaned + b'=' * (-len(cleaned) % 4), validate=True)
+    except binascii.Error:
+        return None
 
-def get_processed_content_from_url(url: str) -> str:
+def write_atomic(path: str, data: bytes | Iterable[bytes]):
     """
-    Fetches content using undetected_chromedriver to bypass advanced bot detection
-    systems like Cloudflare's JavaScript challenge.
+    Writes data (bytes, or an iterable of byte chunks) to a temporary file next to
+    path and renames it into place, so an interrupted run never leaves a truncated
+    output file behind.
     """
-    processed_url = convert_github_url_to_raw(url)
-    
-    # --- Undetected Chromedriver Setup ---
+    directory, name = os.path.split(path)
+    with tempfile.NamedTemporaryFile(dir=directory or ".", prefix=f".{name}.", delete=False) as tmp:
+        try:
+            if isinstance(data, bytes):
+                tmp.write(data)
+            else:
+                tmp.writelines(data)
+            os.chmod(tmp.name, FILE_MODE)
+        except BaseException:
+            tmp.close()
+            os.unlink(tmp.name)
+            raise
+    os.replace(tmp.name, path)
+
+def create_driver():
+    """
+    Starts a headless undetected_chromedriver instance. Drivers are expensive to
+    launch, so they are pooled and reused for many URLs (see acquire_driver).
+    """
+    # --- STEALTH MODE IMPORTS ---
+    # The key to bypassing advanced bot detection like Cloudflare. Imported here so runs
+    # where every source answers plain HTTP never load the browser stack at all.
+    import undetected_chromedriver as uc
+
     options = uc.ChromeOptions()
     options.add_argument("--headless")
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
     options.add_argument("--disable-gpu")
     options.add_argument(f"user-agent={random.choice(USER_AGENTS)}")
-    
+    # Only the page text is needed: skip images, stylesheets and extensions, and let
+    # driver.get() return at DOMContentLoaded. JavaScript stays on for the challenge.
+    options.add_argument("--disable-extensions")
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option("prefs", {
+        "profile.managed_default_content_settings.images": 2,
+        "profile.managed_default_content_settings.stylesheets": 2,
+    })
+    options.page_load_strategy = "eager"
+
+    # It handles chromedriver download automatically.
+    with _DRIVER_START_LOCK:
+        driver = uc.Chrome(options=options)
+        _all_drivers.append(driver)
+
+    # Set a generous timeout. Cloudflare checks can take time.
+    driver.set_page_load_timeout(45)
+    return driver
+
+def acquire_driver():
+    _browser_slots.acquire()
+    try:
+        return _idle_drivers.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        return create_driver()
+    except BaseException:
+        _browser_slots.release()
+        raise
+
+def release_driver(driver):
+    uses = _driver_uses.get(id(driver), 0) + 1
+    if uses >= BROWSER_RECYCLE_AFTER:
+        discard_driver(driver)
+        return
+    _driver_uses[id(driver)] = uses
+    _idle_drivers.put(driver)
+    _browser_slots.release()
+
+def discard_driver(driver):
+    with _DRIVER_START_LOCK:
+        _all_drivers.remove(driver)
+    _driver_uses.pop(id(driver), None)
+    _browser_slots.release()
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+def close_drivers():
+    with _DRIVER_START_LOCK:
+        drivers = _all_drivers[:]
+        _all_drivers.clear()
+    for driver in drivers:
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+def is_challenge_page(page: str | bytes) -> bool:
+    markers = _CHALLENGE_MARKERS_BYTES if isinstance(page, bytes) else CHALLENGE_MARKERS
+    return any(marker in page for marker in markers)
+
+def fetch_over_http(url: str, validators: dict) -> tuple[bytes | NotModified | None, bool]:
+    """
+    Fetches url through the pooled requests session. Returns (body, needs_browser):
+    body is the raw response bytes, NOT_MODIFIED, or None on failure, and needs_browser
+    is set when the host answered with a bot challenge that only the stealth browser
+    can get past.
+
+    validators holds the ETag/Last-Modified of the last successful download and is
+    sent as a conditional request; it is replaced with the new response's values,
+    or emptied when this fetch does not yield a fresh 200.
+    """
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    previous = dict(validators)
+    validators.clear()
+    try:
+        with SESSION.get(url, headers=headers, timeout=HTTP_TIMEOUT, stream=True) as response:
+            if response.status_code == 304:
+                print(f"    - [Not Modified] Unchanged since the last run: {url[:70]}...")
+                validators.update(previous)
+                return NOT_MODIFIED, False
+            if response.status_code in BROWSER_FALLBACK_STATUSES:
+                print(f"    - [Challenge] HTTP {response.status_code}, retrying with the stealth browser: {url[:70]}...")
+                return None, True
+            if response.status_code != 200:
+                print(f"    - [ERROR] HTTP {response.status_code} for {url[:70]}")
+                return None, False
+            # Raw bytes only: skips response.text's charset detection and str copy.
+            body = b"".join(response.iter_content(chunk_size=HTTP_CHUNK_SIZE))
+            new_validators = {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+            }
+    except Exception as e:
+        # Not only RequestException: urllib3 raises its own errors (e.g. LocationParseError)
+        # for malformed URLs, and one bad source must not abort the run.
+        print(f"    - [ERROR] HTTP request failed for {url[:70]}: {e}")
+        return None, False
+
+    if is_challenge_page(body):
+        print(f"    - [Challenge] Bot check page served, retrying with the stealth browser: {url[:70]}...")
+        return None, True
+    validators.update((k, v) for k, v in new_validators.items() if v)
+    return body, False
+
+def fetch_with_browser(url: str) -> str | None:
+    """
+    Fetches content using undetected_chromedriver to bypass advanced bot detection
+    systems like Cloudflare's JavaScript challenge.
+    """
     driver = None
     try:
-        # Initialize the stealth driver. It handles chromedriver download automatically.
-        driver = uc.Chrome(options=options)
-        
-        # Set a generous timeout. Cloudflare checks can take time.
-        driver.set_page_load_timeout(45)
-        
-        driver.get(processed_url)
-        
-        # Wait longer to allow Cloudflare's JS challenges to complete.
-        print("    - Waiting for potential security checks (e.g., Cloudflare)...")
-        time.sleep(10) # Increased wait time is crucial
-        
-        # Extract content from the body
-        content = driver.find_element(By.TAG_NAME, "body").text
-        
-        # Explicitly check if we are still stuck on a Cloudflare page
-        if "Verifying you are human" in content or "needs to review the security" in content:
-            print("    - [FAILURE] Cloudflare block is still active. Could not retrieve content.")
+        from selenium.common.exceptions import TimeoutException
+        from selenium.webdriver.common.by import By
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        driver = acquire_driver()
+        driver.get(url)
+
+        # Poll until Cloudflare's JS challenge (if any) has cleared, instead of a fixed sleep.
+        try:
+            WebDriverWait(driver, CHALLENGE_TIMEOUT).until(lambda d: not is_challenge_page(d.page_source))
+        except TimeoutException:
+            print(f"    - [FAILURE] Cloudflare block is still active for {url[:70]}. Could not retrieve content.")
             return None
 
-        # --- End of Stealth Driver Logic ---
+        # Extract content from the body
+        return driver.find_element(By.TAG_NAME, "body").text
 
-        if is_base64(content):
-            print(f"    - [Base64 Detected] Processing URL: {processed_url[:70]}...")
-            cleaned_content = "".join(content.split())
-            return base64.b64decode(cleaned_content).decode('utf-8')
-        else:
-            print(f"    - [Plain Text] Processing URL: {processed_url[:70]}...")
-            return content
-            
     except Exception as e:
-        print(f"    - [ERROR] Failed during stealth navigation for {processed_url[:70]}: {e}")
+        print(f"    - [ERROR] Failed during stealth navigation for {url[:70]}: {e}")
+        # The browser may be in a bad state; do not hand it to the next URL.
+        if driver:
+            discard_driver(driver)
+            driver = None
         return None
     finally:
         if driver:
-            driver.quit()
+            release_driver(driver)
+
+def get_processed_content_from_url(url: str, validators: dict) -> bytes | NotModified | None:
+    """
+    Fetches a source with a plain HTTP request, falling back to the stealth browser
+    only when the host serves a bot challenge, and decodes Base64 subscriptions.
+    Content stays as UTF-8 bytes all the way to the output files. Returns
+    NOT_MODIFIED when the conditional request says the source is unchanged.
+    """
+    processed_url = convert_github_url_to_raw(url)
+
+    body, needs_browser = fetch_over_http(processed_url, validators)
+    if needs_browser and urlsplit(processed_url).hostname in RAW_HOSTS:
+        print(f"    - [FAILURE] Static host refused the request; not retrying in a browser: {processed_url[:70]}")
+        return None
+    if needs_browser:
+        page_text = fetch_with_browser(processed_url)
+        body = page_text.encode('utf-8') if page_text is not None else None
+    if body is None or body is NOT_MODIFIED:
+        return body
+
+    decoded = decode_base64(body) if _B64_RE.match(body[:B64_SNIFF_SIZE]) else None
+    if decoded is not None and _PROXY_URI_RE.search(decoded, 0, B64_SNIFF_SIZE):
+        print(f"    - [Base64 Detected] Processing URL: {processed_url[:70]}...")
+        return decoded
+    else:
+        print(f"    - [Plain Text] Processing URL: {processed_url[:70]}...")
+        return body
+
+def split_unique_lines(content: bytes) -> tuple[bytes, ...]:
+    """Stripped, non-empty lines of content in first-seen order, without duplicates."""
+    stripped = (line.strip() for line in content.splitlines())
+    return tuple(dict.fromkeys(line for line in stripped if line))
+
+def iter_joined_lines(lines, chunk_size: int = OUTPUT_CHUNK_SIZE):
+    """Yields b"\\n".join(lines) in chunks of about chunk_size bytes."""
+    buf = bytearray()
+    separator = b""
+    for line in lines:
+        buf += separator
+        buf += line
+        separator = b"\n"
+        if len(buf) >= chunk_size:
+            yield bytes(buf)
+            buf.clear()
+    if buf:
+        yield bytes(buf)
+
+def iter_base64(chunks):
+    """Base64-encodes a stream of byte chunks; the pieces concatenate to b64encode() of the whole."""
+    carry = b""
+    for chunk in chunks:
+        data = carry + chunk
+        # Only whole 3-byte groups are encoded, so no padding appears mid-stream.
+        cut = len(data) - len(data) % 3
+        if cut:
+            yield base64.b64encode(data[:cut])
+        carry = data[cut:]
+    if carry:
+        yield base64.b64encode(carry)
+
+def fetch_source_lines(url: str, validators: dict) -> tuple[bytes, ...] | NotModified | None:
+    content = get_processed_content_from_url(url, validators)
+    if content is None or content is NOT_MODIFIED:
+        return content
+    if validators:
+        # The cache is best-effort; a failed write only costs a download next run.
+        try:
+            save_cached_content(url, validators, content)
+        except OSError as e:
+            print(f"    - [WARNING] Could not cache content of {url[:70]}: {e}")
+    return split_unique_lines(content)
+
+def cache_path(url: str) -> str:
+    return os.path.join(CACHE_DIR, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+def save_cached_content(url: str, validators: dict, content: bytes):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    header = json.dumps(validators, sort_keys=True).encode('utf-8')
+    write_atomic(cache_path(url), header + b"\n" + content)
+
+def load_cached_content(url: str, validators: dict) -> bytes | None:
+    """Cached content of url, or None if missing or stored under other validators."""
+    try:
+        with open(cache_path(url), 'rb') as f:
+            if json.loads(f.readline()) != validators:
+                return None
+            return f.read()
+    except (OSError, ValueError):
+        return None
+
+def prune_cache(urls):
+    """Removes cached bodies of sources no longer cached; failures only leave stale files behind."""
+    if not os.path.isdir(CACHE_DIR):
+        return
+    keep = {os.path.basename(cache_path(url)) for url in urls}
+    try:
+        names = os.listdir(CACHE_DIR)
+    except OSError as e:
+        print(f"Warning: Could not list cache directory '{CACHE_DIR}': {e}")
+        return
+    for name in names:
+        if name not in keep:
+            try:
+                os.remove(os.path.join(CACHE_DIR, name))
+            except OSError as e:
+                print(f"Warning: Could not remove stale cache file '{name}': {e}")
+
+async def fetch_all(urls, source_state):
+    """
+    Fetches every source concurrently (bounded by MAX_CONCURRENT_FETCHES overall
+    and MAX_FETCHES_PER_HOST per host) and returns a mapping of URL -> tuple of its
+    unique lines, with None for sources that failed and NOT_MODIFIED for unchanged
+    ones. Splitting happens once per source, however many output files use it.
+    source_state[url] holds each URL's validators.
+    """
+    # The default executor has only min(32, CPUs + 4) threads, which would cap
+    # the blocking fetches below MAX_CONCURRENT_FETCHES on small runners.
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FETCHES))
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_FETCHES)
+    host_semaphores = defaultdict(lambda: asyncio.Semaphore(MAX_FETCHES_PER_HOST))
+
+    async def fetch(url):
+        async with host_semaphores[urlsplit(url).hostname], semaphore:
+            return await asyncio.to_thread(fetch_source_lines, url, source_state[url])
+
+    contents = await asyncio.gather(*(fetch(url) for url in urls), return_exceptions=True)
+    fetched = {}
+    for url, content in zip(urls, contents):
+        if isinstance(content, Exception):
+            print(f"    - [ERROR] Unexpected error while fetching {url[:70]}: {content!r}")
+            content = None
+        elif isinstance(content, BaseException):
+            raise content
+        fetched[url] = content
+    return fetched
+
+def output_paths(output_name):
+    # Plain "dir/name" strings: they are both the file paths and the README link paths.
+    return f"{NORMAL_DIR}/{output_name}.txt", f"{BASE64_DIR}/{output_name}.b64"
+
+def is_unchanged(output_name, individual_urls, fetched, previous):
+    """
+    True when the output was last built from exactly these sources, in this order
+    (previous is its state record, if any), every source answered 304, and the
+    previous output files are still on disk.
+    """
+    return (previous is not None and previous['sources'] == individual_urls
+            and all(fetched[url] is NOT_MODIFIED for url in individual_urls)
+            and all(os.path.exists(path) for path in output_paths(output_name)))
+
+def process_entry(output_name, individual_urls, fetched, output_state, unchanged=False):
+    """
+    Combines, deduplicates and writes one output file from already-fetched
+    sources. Returns its README record, or None if nothing could be fetched.
+    Files are left untouched when no source changed (unchanged) or the result is
+    identical to the last run (output_state maps output name -> {"digest": sha256 of
+    the .txt, "sources": its ordered source URLs}).
+    The log is printed in one block so parallel entries do not interleave.
+    """
+    log = [f"\n{'='*20} Processing Output File: {output_name} {'='*20}",
+           f"Found {len(individual_urls)} source(s) for this file."]
+    try:
+        normal_path, base64_path = output_paths(output_name)
+        record = {"name": output_name, "normal_path": normal_path, "base64_path": base64_path}
+        if unchanged:
+            log.append(f"[FINAL STATUS] All sources unchanged since the last run; keeping {normal_path} and {base64_path}")
+            log.append(f"{'='* (58 + len(output_name))}")
+            return record
+
+        source_lines = []
+        for i, url in enumerate(individual_urls):
+            log.append(f"  [{i+1}/{len(individual_urls)}] Source: {url[:70]}")
+            lines = fetched[url]
+            if isinstance(lines, tuple):
+                log.append(f"    - [SUCCESS] Fetched {len(lines)} unique lines of content.")
+                source_lines.append(lines)
+            else:
+                log.append(f"    - [FAILURE] No content retrieved from this source.")
+
+        if not source_lines:
+            log.append(f"[FINAL WARNING] Could not fetch any valid content for '{output_name}'. Skipping.")
+            log.append(f"{'='* (58 + len(output_name))}")
+            return None
+
+        log.append(f"\n  Combining content for '{output_name}':")
+        log.append(f"  - Successfully fetched content from {len(source_lines)} out of {len(individual_urls)} sources.")
+        # Sources arrive pre-split and deduplicated, so this only merges across sources.
+        seen = set()
+        unique_lines = []
+        total_lines = 0
+        for lines in source_lines:
+            total_lines += len(lines)
+            for line in lines:
+                if line not in seen:
+                    seen.add(line)
+                    unique_lines.append(line)
+        log.append(f"  - Total lines before deduplication: {total_lines}")
+        log.append(f"  - Total unique (non-empty) lines after deduplication: {len(unique_lines)}")
+        # The combined text is only ever streamed: hashed first, then written
+        # (and Base64-encoded) chunk by chunk if it changed.
+        hasher = hashlib.sha256()
+        for chunk in iter_joined_lines(unique_lines):
+            hasher.update(chunk)
+        digest = hasher.hexdigest()
+        previous = output_state.get(output_name)
+        output_state[output_name] = {"digest": digest, "sources": individual_urls}
+        if (previous is not None and previous['digest'] == digest
+                and os.path.exists(normal_path) and os.path.exists(base64_path)):
+            log.append(f"\n[FINAL STATUS] Content identical to the last run; kept {normal_path} and {base64_path}")
+        else:
+            write_atomic(normal_path, iter_joined_lines(unique_lines))
+            write_atomic(base64_path, iter_base64(iter_joined_lines(unique_lines)))
+            log.append(f"\n[FINAL STATUS] Processed '{output_name}': created {normal_path} and {base64_path}")
+        log.append(f"{'='* (58 + len(output_name))}")
+        return record
+    finally:
+        print("\n".join(log))
 
 # --- Main Logic (with detailed logging) ---
 
@@ -112,84 +543,124 @@ def main():
         print(f"Error: Input file '{LINKS_FILE}' not found.")
         return
 
-    processed_files = []
+    entries = []
     with open(LINKS_FILE, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
 
-    for line in lines:
-        line = line.strip()
-        if not line or line.startswith('#'):
-            continue
-        
-        time.sleep(random.uniform(1, 3)) # Human-like delay
-        parts = line.split(',', 1)
-        if len(parts) != 2:
-            print(f"Warning: Skipping malformed line: {line}")
-            continue
-        
-        sources_part, output_name = parts[0].strip(), parts[1].strip()
-        print(f"\n{'='*20} Processing Output File: {output_name} {'='*20}")
-        individual_urls = [s.strip() for s in sources_part.split('|')]
-        print(f"Found {len(individual_urls)} source(s) for this file.")
-        
-        all_contents = []
-        for i, url in enumerate(individual_urls):
-            print(f"  [{i+1}/{len(individual_urls)}] Fetching from source...")
-            content = get_processed_content_from_url(url)
-            if content is not None:
-                line_count = len(content.splitlines())
-                print(f"    - [SUCCESS] Fetched {line_count} lines of content.")
-                all_contents.append(content)
+            sources_part, sep, output_name = line.partition(',')
+            if not sep:
+                print(f"Warning: Skipping malformed line: {line}")
+                continue
+
+            # Normalized up front so a blob link and its raw form share one fetch.
+            individual_urls = [convert_github_url_to_raw(s.strip()) for s in sources_part.split('|')]
+            entries.append((output_name.strip(), individual_urls))
+
+    # Fetch every distinct source once, up front, so that all network waits overlap
+    # and sources shared by several output files are not downloaded again.
+    source_counts = Counter(url for _, urls in entries for url in urls)
+    unique_urls = list(source_counts)
+    print(f"Fetching {len(unique_urls)} unique source(s) for {len(entries)} output file(s)...")
+    shared = sum(count - 1 for count in source_counts.values())
+    if shared:
+        print(f"  - {shared} duplicate source reference(s) will reuse an earlier fetch.")
+    state = load_state()
+    source_state = {url: dict(state['sources'].get(url, {})) for url in unique_urls}
+    output_state = {name: state['outputs'][name] for name, _ in entries if name in state['outputs']}
+    try:
+        fetched = asyncio.run(fetch_all(unique_urls, source_state))
+
+        # An output is only reused as-is when none of its sources changed; otherwise
+        # the unchanged sources are needed in full: from the cache, or fetched again
+        # unconditionally.
+        unchanged_outputs = {
+            name for name, urls in entries if is_unchanged(name, urls, fetched, output_state.get(name))
+        }
+        needed = dict.fromkeys(
+            url
+            for output_name, urls in entries if output_name not in unchanged_outputs
+            for url in urls if fetched[url] is NOT_MODIFIED
+        )
+        refetch = []
+        for url in needed:
+            content = load_cached_content(url, source_state[url])
+            if content is None:
+                refetch.append(url)
             else:
-                print(f"    - [FAILURE] No content retrieved from this source.")
-        
-        if not all_contents:
-            print(f"[FINAL WARNING] Could not fetch any valid content for '{output_name}'. Skipping.")
-            print(f"{'='* (58 + len(output_name))}")
-            continue
-
-        print(f"\n  Combining content for '{output_name}':")
-        print(f"  - Successfully fetched content from {len(all_contents)} out of {len(individual_urls)} sources.")
-        raw_combined_content = "\n".join(c.strip() for c in all_contents)
-        total_lines = raw_combined_content.splitlines()
-        print(f"  - Total lines before deduplication: {len(total_lines)}")
-        unique_lines = list(dict.fromkeys(line for line in total_lines if line.strip()))
-        print(f"  - Total unique (non-empty) lines after deduplication: {len(unique_lines)}")
-        final_content = "\n".join(unique_lines)
-
-        normal_path = Path(NORMAL_DIR) / f"{output_name}.txt"
-        normal_path.write_text(final_content, encoding='utf-8')
-        base64_final_content = base64.b64encode(final_content.encode('utf-8')).decode('utf-8')
-        base64_path = Path(BASE64_DIR) / f"{output_name}.b64"
-        base64_path.write_text(base64_final_content, encoding='utf-8')
-        
-        print(f"\n[FINAL STATUS] Processed '{output_name}': created {normal_path} and {base64_path}")
-        print(f"{'='* (58 + len(output_name))}")
-        processed_files.append({"name": output_name, "normal_path": normal_path.as_posix(), "base64_path": base64_path.as_posix()})
+                fetched[url] = split_unique_lines(content)
+        if len(needed) > len(refetch):
+            print(f"Loaded {len(needed) - len(refetch)} unchanged source(s) from the local cache.")
+        if refetch:
+            print(f"Re-fetching {len(refetch)} unchanged source(s) needed by updated output file(s)...")
+            for url in refetch:
+                source_state[url].clear()
+            fetched.update(asyncio.run(fetch_all(refetch, source_state)))
+    finally:
+        close_drivers()
 
+    with ThreadPoolExecutor(max_workers=MAX_OUTPUT_WORKERS) as executor:
+        results = executor.map(
+            lambda entry: process_entry(*entry, fetched, output_state, entry[0] in unchanged_outputs),
+            entries,
+        )
+        processed_files = [r for r in results if r is not None]
+
+    prune_cache(url for url, validators in source_state.items() if validators)
+    save_state({
+        "sources": {url: validators for url, validators in source_state.items() if validators},
+        "outputs": {f['name']: output_state[f['name']] for f in processed_files if f['name'] in output_state},
+    })
     update_readme(processed_files)
     print("\nREADME.md has been updated.")
 
 
+def load_state():
+    try:
+        with open(STATE_FILE, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = {}
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable state file '{STATE_FILE}': {e}")
+        state = {}
+    state.setdefault('sources', {})
+    # Older state files stored a bare digest per output; without its source list
+    # such an output is simply rebuilt once.
+    state['outputs'] = {
+        name: record for name, record in state.get('outputs', {}).items()
+        if isinstance(record, dict) and 'digest' in record and 'sources' in record
+    }
+    return state
+
+
+def save_state(state):
+    data = json.dumps(state, indent=2, sort_keys=True) + "\n"
+    write_atomic(STATE_FILE, data.encode('utf-8'))
+
+
 def update_readme(processed_files):
-    tehran_tz = pytz.timezone('Asia/Tehran')
-    now_tehran = datetime.now(tehran_tz)
+    now_tehran = datetime.now(README_TZ)
     timestamp = now_tehran.strftime('%Y-%m-%d %H:%M:%S %Z')
-    content = f"# Processed Links Collection\n\n"
-    content += f"Last updated: `{timestamp}`\n\n"
-    content += "This repository contains automatically processed lists from various sources.\n\n"
-    content += "| File Name | Normal Format (Raw) | Base64 Format (Raw) |\n"
-    content += "|-----------|-----------------------|-----------------------|\n"
+    parts = [
+        "# Processed Links Collection\n\n",
+        f"Last updated: `{timestamp}`\n\n",
+        "This repository contains automatically processed lists from various sources.\n\n",
+        "| File Name | Normal Format (Raw) | Base64 Format (Raw) |\n",
+        "|-----------|-----------------------|-----------------------|\n",
+    ]
     raw_base_url = f"https://raw.githubusercontent.com/{GITHUB_REPO}/main"
     if not processed_files:
-        content += "| *No files processed* | | |\n"
+        parts.append("| *No files processed* | | |\n")
     else:
-        for file_info in sorted(processed_files, key=lambda x: x['name']):
-            name = file_info['name']
-            normal_link = f"{raw_base_url}/{file_info['normal_path']}"
-            base64_link = f"{raw_base_url}/{file_info['base64_path']}"
-            content += f"| `{name}` | [Link]({normal_link}) | [Link]({base64_link}) |\n"
-    Path(README_FILE).write_text(content, encoding='utf-8')
+        row = "| `{}` | [Link]({}/{}) | [Link]({}/{}) |\n"
+        parts.extend(
+            row.format(f['name'], raw_base_url, f['normal_path'], raw_base_url, f['base64_path'])
+            for f in sorted(processed_files, key=lambda x: x['name'])
+        )
+    write_atomic(README_FILE, "".join(parts).encode('utf-8'))
 
 
 if __name__ == "__main__":